@@ -1,5 +1,5 @@
+from functools import cache
 from pathlib import Path
-from unittest import case
 import re
 
 import pyparsing
@@ -9,25 +9,96 @@ from .model import Literal
 
 INDENT = 4 * " "
 
+INDENTS = [level * INDENT for level in range(32)]
+"""Precomputed indentation strings for common nesting levels."""
+
+KEYWORD_STATEMENTS = frozenset(("return", "break", "continue"))
+"""Statements consisting of a single keyword."""
+
+SPACED_BLOCKS = frozenset(
+    ("classdef", "function", "methods", "properties", "arguments")
+)
+"""Blocks which are separated from surrounding code by an empty line."""
+
+SPACED_BLOCK_BODIES = frozenset(("classdef", "methods"))
+"""Blocks whose body is separated from head and end by an empty line."""
+
+BLANK_FILE = re.compile(r"[ \t\n;]*")
+"""File content consisting only of whitespace and semicolons."""
+
 
 def format_type(type_: type[model.Component]):
+    """
+    Turn a function formatting a single element into a formatter for a whole tree. The
+    function is applied to each descendant of type 'type_'.
+    """
+
     def decorator(func):
         def wrapper(code: model.Composite):
-            for element in code.descendants():
-                if isinstance(element, type_):
-                    func(element)
+            apply_formatters(code, wrapper)
 
+        wrapper.element_type = type_
+        wrapper.format_element = func
         return wrapper
 
     return decorator
 
 
+def apply_formatters(code: model.Composite, *formatters):
+    """
+    Apply several formatters created with 'format_type' in a single traversal of the
+    tree. Each element is passed to its matching formatters in the given order.
+    """
+    # Formatters to be applied for each concrete element type. Looking up the type of
+    # each element is cheaper than calling isinstance() for each formatter.
+    dispatch: dict[type, tuple] = {}
+    for element in code.descendants():
+        type_ = type(element)
+        functions = dispatch.get(type_)
+        if functions is None:
+            functions = dispatch[type_] = element_functions(type_, formatters)
+        for function in functions:
+            function(element)
+
+
+def apply_formatters_by_type(
+    elements_by_type: dict[type[model.Component], list[model.Component]], *formatters
+):
+    """
+    Like 'apply_formatters', but for elements grouped by type (see
+    'Composite.descendants_by_type'). Only groups with matching formatters are visited,
+    so the formatters must not depend on the order of elements of different types.
+    """
+    for type_, elements in elements_by_type.items():
+        functions = element_functions(type_, formatters)
+        if not functions:
+            continue
+        for element in elements:
+            for function in functions:
+                function(element)
+
+
+@cache
+def element_functions(type_: type[model.Component], formatters: tuple) -> tuple:
+    """
+    Functions of the formatters which apply to elements of the given type. Cached, as
+    the same formatters are applied to the same element types for every file.
+    """
+    return tuple(
+        formatter.format_element
+        for formatter in formatters
+        if issubclass(type_, formatter.element_type)
+    )
+
+
 @format_type(model.DelimitedList)
 def normalize_whitespace_in_delimited_list(delimited_list: model.DelimitedList):
-    for i, element in enumerate(delimited_list):
-        # Children 1, 3, ... are whitespace and delimiters.
-        if i % 2 == 0:
-            continue
+    children = delimited_list.children
+    last = len(children) - 1
+
+    # Children 1, 3, ... are whitespace and delimiters.
+    for i in range(1, len(children), 2):
+        element = children[i]
         assert isinstance(element, model.Literal)
         string = element.value
 
@@ -39,10 +110,10 @@ def normalize_whitespace_in_delimited_list(delimited_list: model.DelimitedList):
         string = string.replace("...", "")  # Remove ellipsis
 
         # Add single space after delimiter, if it is not the trailing delimiter.
-        if i < len(delimited_list) - 1:
+        if i < last:
             string += " "
 
-        if not any(char in string for char in ",;"):
+        if "," not in string and ";" not in string:
             string = " " + string
         element.value = string
 
@@ -62,39 +133,37 @@ def normalize_whitespace_in_assignment(output_arguments: model.AssignmentTarget)
 
 @format_type(model.Block)
 def remove_post_block_whitespace_and_semicolon(block: model.Block):
-    if isinstance(block.end, model.Missing):
+    if type(block.end) is model.Missing:
         return
-    if not isinstance(block.successor, model.Literal):
+    if type(block.successor) is not model.Literal:
         return
     block.successor.regex_replace(pattern=r"^(\s*;+)+", repl="")
 
 
 @format_type(model.Block)
 def remove_post_block_head_whitespace_and_semicolon(block: model.Block):
-    if isinstance(block.pre_body_delimiter, model.Literal):
+    if type(block.pre_body_delimiter) is model.Literal:
         block.pre_body_delimiter.regex_replace(pattern=r"^(\s*;+)+", repl="")
 
 
-def remove_white_space_and_semicolon_after_keyword(code: model.Composite):
-    for element in code.descendants():
-        match element:
-            case model.Literal(
-                predecessor=(
-                    # Predecessor is keyword statement.
-                    model.Statement(
-                        body=Literal(value="return" | "break" | "continue")
-                    )
-                    # Or predecessor is model.Code with the last element being a keyword statement.
-                    | model.Code(
-                        children=[*_, model.Statement(body=Literal(value="return" | "break" | "continue"))]
-                    )
+@format_type(model.Literal)
+def remove_white_space_and_semicolon_after_keyword(literal: model.Literal):
+    match literal:
+        case model.Literal(
+            predecessor=(
+                # Predecessor is keyword statement.
+                model.Statement(body=Literal(value=keyword))
+                # Or predecessor is model.Code with the last element being a keyword statement.
+                | model.Code(
+                    children=[*_, model.Statement(body=Literal(value=keyword))]
                 )
-            ):
-                element.regex_replace(pattern=r"^(\s*;+)+", repl="")
+            )
+        ) if (keyword in KEYWORD_STATEMENTS):
+            literal.regex_replace(pattern=r"^(\s*;+)+", repl="")
 
-                # Ensure delimiter contains at least one space.
-                if element.value == "":
-                    element.value = " "
+            # Ensure delimiter contains at least one space.
+            if literal.value == "":
+                literal.value = " "
 
 
 @format_type(model.Literal)
@@ -105,7 +174,7 @@ def remove_white_space_before_semicolon(literal: model.Literal):
 @format_type(model.Function)
 def ensure_function_end(function: model.Function):
     """Ensure function block ends with 'end' keyword."""
-    if function.pre_end_delimiter == Literal(""):
+    if function.pre_end_delimiter.value == "":
         function.pre_end_delimiter = Literal("\n")
     function.end = model.End()
 
@@ -135,20 +204,19 @@ def ensure_empty_line_before_comment(code: model.Code):
     """Ensures an empty line before each block of comments."""
     for i, child in enumerate(code.children):
 
-        if not isinstance(child, model.Comment):
+        if type(child) is not model.Comment:
             continue
 
         if child.predecessor is None:
             continue
         predecessor = child.predecessor
 
-        if predecessor.predecessor is None or isinstance(
-            predecessor.predecessor, model.Comment
+        if (
+            predecessor.predecessor is None
+            or type(predecessor.predecessor) is model.Comment
         ):
             continue
 
-        assert type(predecessor) is model.Literal
-
         # Inline comment, or already has an empty line before it.
         if predecessor.value.count("\n") != 1:
             continue
@@ -171,45 +239,40 @@ def normalize_indentation(composite: model.Composite):
         predecessor = element.predecessor
 
         element_is_block_head = (
-            parent
+            parent is not None
             and isinstance(parent, model.Block)
-            and type(parent.head) is type(element)
-            and parent.head == element
+            and parent.head is element
         )
         if element_is_block_head:
             continue
 
         assert level >= 0
-        indent = level * INDENT
-
-        if not predecessor and not parent:
-            continue
+        indent = INDENTS[level] if level < len(INDENTS) else level * INDENT
 
-        if predecessor:
+        if predecessor is not None:
             preceding_literal = predecessor
-        else:
+        elif parent is not None:
             preceding_literal = parent.predecessor
+        else:
+            continue
 
-        # Predecessor should be whitespace and semicolons.
-        assert isinstance(preceding_literal, model.Literal)
-
+        # Predecessor should be a literal of whitespace and semicolons.
         string = preceding_literal.value
-        assert re.match(pattern=r"( \n;)*", string=string)
 
         # Skip inline comments.
-        if isinstance(element, model.Comment) and "\n" not in string:
+        if type(element) is model.Comment and "\n" not in string:
             continue
 
         # Remove current indentation (to be added later).
         string = string.rstrip(" ")
 
-        # Ensure there is a newline at the end of the whitespace, so that the current
-        # element is on a new line (unless it's a comment).
-        if preceding_literal.predecessor and "\n" not in string:
-            string += "\n"
-
-        # Add normalized indentation.
-        preceding_literal.value = string + indent
+        # Add normalized indentation. Ensure there is a newline at the end of the
+        # whitespace, so that the current element is on a new line (unless it's a
+        # comment).
+        if preceding_literal.predecessor is not None and "\n" not in string:
+            preceding_literal.value = f"{string}\n{indent}"
+        else:
+            preceding_literal.value = string + indent
 
 
 @format_type(model.Literal)
@@ -220,23 +283,15 @@ def remove_excess_empty_lines(literal: model.Literal):
 @format_type(model.Literal)
 def add_empty_lines_before_and_after_blocks(literal: model.Literal):
     match literal:
-        case model.Literal(
-            predecessor=model.Block(
-                name=model.Literal(
-                    "classdef" | "function" | "methods" | "properties" | "arguments"
-                )
-            )
+        case model.Literal(predecessor=model.Block(name=model.Literal(name))) if (
+            name in SPACED_BLOCKS
         ):
             while literal.value.count("\n") < 2:
                 literal.value += "\n"
-        case model.Literal(
-            successor=model.Block(
-                name=model.Literal(
-                    "classdef" | "function" | "methods" | "properties" | "arguments"
-                )
-            )
+        case model.Literal(successor=model.Block(name=model.Literal(name))) if (
+            name in SPACED_BLOCKS
         ):
-            if isinstance(literal.predecessor, model.Comment):
+            if type(literal.predecessor) is model.Comment:
                 return
             while literal.value.count("\n") < 2:
                 literal.value += "\n"
@@ -244,7 +299,7 @@ def add_empty_lines_before_and_after_blocks(literal: model.Literal):
 
 @format_type(model.Block)
 def add_empty_lines_around_block_body(block: model.Block):
-    if block.name not in ["classdef", "methods"]:
+    if block.name.value not in SPACED_BLOCK_BODIES:
         return
     for delimiter in (block.pre_body_delimiter, block.pre_end_delimiter):
         while delimiter.value.count("\n") < 2:
@@ -284,26 +339,45 @@ def add_empty_lines_around_block_body(block: model.Block):
 
 
 def format_model(file: model.File):
-    normalize_whitespace_in_delimited_list(file)
-    normalize_whitespace_in_parenthesized(file)
-    normalize_whitespace_in_assignment(file)
-    remove_post_block_whitespace_and_semicolon(file)
-    remove_post_block_head_whitespace_and_semicolon(file)
-    remove_white_space_before_semicolon(file)
-    remove_white_space_and_semicolon_after_keyword(file)
-    remove_excess_empty_lines(file)
-    add_empty_lines_before_and_after_blocks(file)
-    add_empty_lines_around_block_body(file)
+    # Formatters applied in the same traversal must not depend on each other's results
+    # beyond the order in which the elements are visited.
+    apply_formatters(
+        file,
+        normalize_whitespace_in_delimited_list,
+        normalize_whitespace_in_parenthesized,
+        normalize_whitespace_in_assignment,
+        remove_post_block_whitespace_and_semicolon,
+        remove_post_block_head_whitespace_and_semicolon,
+        remove_white_space_before_semicolon,
+        remove_white_space_and_semicolon_after_keyword,
+        remove_excess_empty_lines,
+        add_empty_lines_before_and_after_blocks,
+    )
+
+    # The remaining formatters target few elements, so these are looked up once instead
+    # of traversing the tree for each formatter. The grouping stays valid because the
+    # targeted blocks, functions, code and comments are never replaced. Some formatters
+    # replace children of them, such as the end of a function or the content of a
+    # comment, but no later formatter targets these new elements.
+    elements_by_type = file.descendants_by_type()
+
+    apply_formatters_by_type(elements_by_type, add_empty_lines_around_block_body)
     normalize_indentation(file)
-    ensure_function_end(file)
     normalize_leading_whitespace(file)
     normalize_trailing_whitespace(file)
-    ensure_empty_line_before_comment(file)
-    ensure_comment_leading_space(file)
+    apply_formatters_by_type(
+        elements_by_type,
+        ensure_function_end,
+        ensure_empty_line_before_comment,
+        ensure_comment_leading_space,
+    )
     # break_arguments(file)
 
 
 def format_string(string: str):
+    # Files without code always format to a single newline, so skip parsing them.
+    if BLANK_FILE.fullmatch(string):
+        return "\n"
     file_model = grammar.parse_string(string)
     format_model(file_model)
     # normalize_indentation(file_model)
@@ -312,5 +386,9 @@ def format_string(string: str):
 
 def format_file(file_path: Path):
     string = file_path.read_text()
-    string = format_string(string)
-    file_path.write_text(string)
+    formatted_string = format_string(string)
+    # Files that are already formatted are not rewritten. Their bytes are compared,
+    # since reading the text converts CRLF line endings, which the written file would
+    # not keep.
+    if formatted_string.encode() != file_path.read_bytes():
+        file_path.write_text(formatted_string)
@@ -5,36 +5,39 @@ Parsing logic for MATLAB code.
 # pyright: reportUnusedExpression=false
 
 
-from typing import Sequence
+from functools import cache
+from typing import Callable, Sequence
 from typing import Literal as LiteralType
 from pathlib import Path
+import copy
 import itertools
+import sys
+import os
+import re
 
 from pyparsing import (
     Char,
     Combine,
     common,
     empty,
-    Empty,
     FollowedBy,
     Forward,
     Keyword,
     Literal,
     Opt,
-    Or,
+    ParseBaseException,
+    ParseElementEnhance,
+    ParseException,
     ParserElement,
     PrecededBy,
     QuotedString,
-    Regex,
     StringEnd,
     rest_of_line,
-    White,
     Word,
     ZeroOrMore,
     Suppress,
 )
 
-from archive.matparse import identifier
 from . import model
 
 OPERATORS = [
@@ -86,6 +89,18 @@ KEYWORDS = [
     "while",
 ]
 
+keyword_chars = r"A-Za-z0-9_$"
+"""Characters that may not surround a keyword, as for pyparsing's Keyword."""
+
+keyword_pattern = (
+    rf"(?<![{keyword_chars}])"
+    + "(?:" + "|".join(KEYWORDS) + ")"
+    + rf"(?![{keyword_chars}])"
+) # fmt: skip
+"""Regular expression matching any reserved keyword."""
+
+keyword_regex = re.compile(keyword_pattern)
+
 # Turn-off the default behavior of ignoring whitespace. Whitespace parsing will be handled manually.
 ParserElement.set_default_whitespace_chars("")
 
@@ -98,28 +113,53 @@ class Leaf(ParserElement):
 
     def __init__(self, literal: str):
         super().__init__()
-        self.parser = Literal(literal)
+        self.match = literal
+        self.errmsg = f"Expected {literal!r}"
+        self.mayIndexError = False
 
     def parseImpl(self, instring, loc, doActions=True):
-        loc, tokens = self.parser._parse(instring, loc, doActions)
-        assert len(tokens) == 1
-        return loc, model.Literal(tokens[0])
+        # Match by hand instead of delegating to a pyparsing Literal, which would add
+        # another element (and packrat cache entry) to every attempt.
+        if instring.startswith(self.match, loc):
+            return loc + len(self.match), model.Literal(self.match)
+        raise ParseException(instring, loc, self.errmsg, self)
 
     def _generateDefaultName(self) -> str:
         return "Leaf"
 
 
-class ReservedKeyword(ParserElement):
-    """A reserved keyword."""
+class RegexLeaf(ParserElement):
+    """
+    Parser for a model.Literal matching a regular expression. Unlike a pyparsing Regex
+    with a parse action, this creates the literal directly from the match.
+    """
 
-    def __init__(self):
+    def __init__(self, pattern: str | re.Pattern):
         super().__init__()
-        self.parser = Or(Keyword(s) for s in KEYWORDS).add_parse_action(
-            model.Literal.from_tokens
-        )
+        self.regex = re.compile(pattern)
+        self.errmsg = f"Expected match of {self.regex.pattern!r}"
+        self.mayReturnEmpty = self.regex.match("") is not None
+        self.mayIndexError = False
 
     def parseImpl(self, instring, loc, doActions=True):
-        return self.parser._parse(instring, loc, doActions)
+        match = self.regex.match(instring, loc)
+        if match is None:
+            raise ParseException(instring, loc, self.errmsg, self)
+        # Identifiers, operators and whitespace repeat all over a file. Interning makes
+        # every occurrence share one string object.
+        return match.end(), model.Literal(sys.intern(match[0]))
+
+    def _generateDefaultName(self) -> str:
+        return "RegexLeaf"
+
+
+class ReservedKeyword(RegexLeaf):
+    """A reserved keyword."""
+
+    def __init__(self):
+        # A single regular expression match instead of trying each keyword in turn.
+        super().__init__(keyword_regex)
+        self.errmsg = "Expected reserved keyword"
 
     def _generateDefaultName(self) -> str:
         return "ReservedKeyword"
@@ -141,20 +181,14 @@ class DelimitedList(ParserElement):
     ):
         super().__init__()
 
-        if isinstance(delimiter, str):
-            delimiter = Literal(delimiter)
-        delimiter_and_whitespace = Combine(ows + delimiter + ows)
-        if delimiter_is_optional:
-            delimiter_and_whitespace = delimiter_and_whitespace | ws
-        delimiter_and_whitespace.add_parse_action(join_strings)
+        delimiter_and_whitespace, trailing_delimiter = delimiter_parsers(
+            delimiter, delimiter_is_optional
+        )
         min_sub_exp = max(min_elements - 1, 0)
         parser = (
             element
             + (delimiter_and_whitespace + element)[min_sub_exp, ...]
-            + (
-                Combine(ows + delimiter).add_parse_action(join_strings)
-                | empty_string(1)
-            )  # Optional trailing delimiter
+            + trailing_delimiter
         )
         if min_elements == 0:
             parser = parser | empty
@@ -162,12 +196,54 @@ class DelimitedList(ParserElement):
 
     def parseImpl(self, instring, loc, doActions=True):
         loc, tokens = self.parser._parse(instring, loc, doActions)
-        return loc, model.DelimitedList(list(tokens))
+        return loc, model.DelimitedList.from_tokens(tokens)
+
+    def streamline(self) -> ParserElement:
+        # pyparsing only streamlines the elements it knows to contain others.
+        if not self.streamlined:
+            super().streamline()
+            self.parser.streamline()
+        return self
 
     def _generateDefaultName(self) -> str:
         return "DelimitedList"
 
 
+class Bracketed(ParserElement):
+    """
+    Parser for content enclosed in one of several pairs of brackets. The alternatives
+    are distinguished by their opening bracket, so only the alternative for the
+    character at the current location is tried.
+    """
+
+    def __init__(self, alternatives: dict[str, ParserElement]):
+        super().__init__()
+        for opening_bracket in alternatives:
+            if len(opening_bracket) != 1:
+                raise ValueError(
+                    f"Opening bracket must be a single character: {opening_bracket!r}"
+                )
+        self.alternatives = alternatives
+        self.errmsg = f"Expected one of {''.join(alternatives)!r}"
+        self.mayIndexError = False
+
+    def parseImpl(self, instring, loc, doActions=True):
+        parser = self.alternatives.get(instring[loc : loc + 1])
+        if parser is None:
+            raise ParseException(instring, loc, self.errmsg, self)
+        return parser._parse(instring, loc, doActions)
+
+    def streamline(self) -> ParserElement:
+        if not self.streamlined:
+            super().streamline()
+            for parser in self.alternatives.values():
+                parser.streamline()
+        return self
+
+    def _generateDefaultName(self) -> str:
+        return "Bracketed"
+
+
 class Block(ParserElement):
 
     def __init__(
@@ -217,28 +293,139 @@ class Block(ParserElement):
     def parseImpl(self, instring, loc, doActions=True):
         return self.parser._parse(instring, loc, doActions)
 
+    def streamline(self) -> ParserElement:
+        if not self.streamlined:
+            super().streamline()
+            self.parser.streamline()
+        return self
+
     def _generateDefaultName(self) -> str:
         return "Block"
 
 
+@cache
+def delimiter_parsers(
+    delimiter: str | ParserElement, delimiter_is_optional: bool
+) -> tuple[ParserElement, ParserElement]:
+    """
+    Parsers for a delimiter surrounded by optional whitespace and for an optional
+    trailing delimiter. Cached, so that delimited lists with the same delimiter share
+    their parsers and thereby their packrat cache entries.
+    """
+    if isinstance(delimiter, str):
+        delimiter = Literal(delimiter)
+    delimiter_and_whitespace = Combine(ows + delimiter + ows)
+    if delimiter_is_optional:
+        delimiter_and_whitespace = delimiter_and_whitespace | ws
+    delimiter_and_whitespace.add_parse_action(join_strings)
+    trailing_delimiter = (
+        Combine(ows + delimiter).add_parse_action(join_strings)
+        | empty_string(1)
+    ) # fmt: skip
+    return delimiter_and_whitespace, trailing_delimiter
+
+
+memoized_elements: list["Memoized"] = []
+
+
+def reset_memoized_elements():
+    for element in memoized_elements:
+        element.cache.clear()
+
+
+class Memoized(ParseElementEnhance):
+    """
+    Parser remembering the results of the wrapped element by location in the string
+    being parsed, for elements that are attempted repeatedly at the same location during
+    backtracking. Unlike packrat parsing, this caches only these elements.
+
+    The results are shared only while the outermost memoized element is being parsed.
+    Once it returns, all caches are cleared, so that no later parse reuses model objects
+    that have already been returned and may have been modified since.
+    """
+
+    depth = 0
+    """Number of memoized elements currently being parsed."""
+
+    def __init__(self, expr: ParserElement):
+        super().__init__(expr)
+        self.callPreparse = False
+        self.cache = {}
+        memoized_elements.append(self)
+
+    def parseImpl(self, instring, loc, doActions=True):
+        Memoized.depth += 1
+        try:
+            return self.parse_memoized(instring, loc, doActions)
+        finally:
+            Memoized.depth -= 1
+            if not Memoized.depth:
+                reset_memoized_elements()
+
+    def parse_memoized(self, instring, loc, doActions):
+        key = (loc, doActions)
+        value = self.cache.get(key)
+        if value is None:
+            try:
+                value = self.expr._parse(instring, loc, doActions, callPreParse=False)
+            except ParseBaseException as e:
+                self.cache[key] = copy.copy(e)
+                raise
+            self.cache[key] = value
+        elif isinstance(value, Exception):
+            # A new copy, since a raised exception keeps a reference to the frames it
+            # passes through, which would keep this cache alive.
+            raise copy.copy(value)
+        # Parent elements extend the returned results in place.
+        return value[0], value[1].copy()
+
+
+class Placeholder(ParserElement):
+    """
+    Parser matching the empty string and returning `n` new placeholder elements.
+
+    Placeholders are never memoized: parsing one is cheaper than a packrat cache lookup,
+    and their entries would only evict those of the expensive elements.
+    """
+
+    _parse = ParserElement._parseNoCache
+
+    def __init__(self, factory: Callable[[], model.Component], n: int):
+        super().__init__()
+        self.factory = factory
+        self.n = n
+        self.mayReturnEmpty = True
+        self.mayIndexError = False
+
+    def parseImpl(self, instring, loc, doActions=True):
+        return loc, [self.factory() for _ in range(self.n)]
+
+    def _generateDefaultName(self) -> str:
+        return "Placeholder"
+
+
 def nothing(n: int = 1):
-    return Empty().set_parse_action(
-        lambda s, loc, toks: [model.Missing() for i in range(n)]
-    )
+    return Placeholder(model.Missing, n)
 
 
 def empty_string(n: int = 1):
-    return Empty().set_parse_action(
-        lambda s, loc, toks: [model.Literal("") for i in range(n)]
-    )
+    return Placeholder(lambda: model.Literal(""), n)
 
 
 def join_strings(s, loc, toks):
-    return model.Literal("".join(str(t) for t in toks))
+    return model.Literal(sys.intern("".join(str(t) for t in toks)))
+
+
+def literal_or(strings: Sequence[str]) -> str:
+    """
+    Regular expression matching the longest of the given strings, as an Or of Literals
+    does, but in a single match.
+    """
+    return "|".join(re.escape(s) for s in sorted(strings, key=len, reverse=True))
 
 
 def regex_literal(pattern: str) -> ParserElement:
-    return Regex(pattern).add_parse_action(model.Literal.from_tokens)
+    return RegexLeaf(pattern)
 
 
 def parenthesized(
@@ -246,15 +433,16 @@ def parenthesized(
     brackets: Sequence[tuple[str, str]] = (("(", ")"),),
     optional: bool = False,
 ):
-    # Turning this into a class was a lot slower for some reason
-    with_parenthesis = Or(
-        (
-            Leaf(opening_bracket) 
-            + ows 
-            + content 
-            + ows 
-            + Leaf(closing_bracket)
-        ) for opening_bracket, closing_bracket in brackets
+    with_parenthesis = Bracketed(
+        {
+            opening_bracket: (
+                Leaf(opening_bracket)
+                + ows
+                + content
+                + ows
+                + Leaf(closing_bracket)
+            ) for opening_bracket, closing_bracket in brackets
+        }
     ) # fmt: skip
 
     if not optional:
@@ -273,35 +461,25 @@ end = Keyword("end").add_parse_action(lambda tokens: model.End())
 
 
 """White space including ellipsis."""
-ws = Combine(
-    (
-        White(" \t\n") 
-        | Literal("...")
-    )[1, ...]
-).parse_with_tabs() # fmt: skip
+ws = RegexLeaf(r"(?:[ \t\n]|\.\.\.)+").parse_with_tabs()
 
 
 """Optional white space"""
-ows = (ws | empty_string()).parse_with_tabs()
+ows = RegexLeaf(r"(?:[ \t\n]|\.\.\.)*").parse_with_tabs()
 
 
-element_delimiter = Combine(
-    (
-        White(" \t") 
-        | (Literal("...") + Regex(r"[ \t]*\n?[ \t]*"))
-    )[1, ...]
-).parse_with_tabs() # fmt: skip
+element_delimiter = RegexLeaf(r"(?:[ \t]|\.\.\.[ \t]*\n?[ \t]*)+").parse_with_tabs()
 
 
-statement_delimiter = Combine(
-    regex_literal(r"\s*;[;\s]*") # Contains a semicolon
-    | regex_literal(r"[ \t]*\n[;\s]*") # or a newline
-    | regex_literal(r"[ \t]*") + FollowedBy(Literal("%")) # or is followed by a comment
-)
+statement_delimiter = RegexLeaf(
+    r"\s*;[;\s]*" # Contains a semicolon
+    r"|[ \t]*\n[;\s]*" # or a newline
+    r"|[ \t]*(?=%)" # or is followed by a comment
+) # fmt: skip
 
 end_delimiter = regex_literal(r"[ \t\n;]+")
 
-operator = Or(OPERATORS)
+operator = RegexLeaf(literal_or(OPERATORS))
 
 
 """
@@ -311,14 +489,14 @@ Examples:
  - a.b.c
 """
 identifier_pattern = {
+    "NotKeyword": f"(?!{keyword_pattern})",
     "Initial": r"[A-Za-z]",
     "Body": r"\w*",  # Include identifiers connected by dots.
 }
 
-identifier = (
-    ~ReservedKeyword() 
-    + Regex("".join(identifier_pattern.values()))
-) # fmt: skip
+# The keyword exclusion is part of the regular expression, so an identifier is matched
+# in a single step instead of trying every keyword with pyparsing first.
+identifier = RegexLeaf("".join(identifier_pattern.values()))
 """An identifier for a variable, function etc."""
 
 
@@ -335,7 +513,7 @@ string = (
 expression = Forward()
 
 
-array_delimiter = Leaf(",") | Leaf(";")
+array_delimiter = RegexLeaf(literal_or([",", ";"]))
 array = parenthesized(
     DelimitedList(
         expression,
@@ -350,19 +528,6 @@ array = parenthesized(
 
 field_suffix = Suppress(Literal(".")) + identifier
 
-call = Forward()
-
-assignment_target = (
-    parenthesized(
-        DelimitedList(call | identifier, delimiter=","),
-        brackets=(("[", "]"),),
-        optional=True,
-    )
-    + ows
-    + Leaf("=")
-    + ows
-)
-
 assignment_statement = Forward()
 
 argument_brackets = (("(", ")"), ("{", "}"))
@@ -376,7 +541,7 @@ arguments_list = (
 ) # fmt: skip
 
 """A variable or a function call with or without arguments. Includes nested calls."""
-call << (
+call = (
     identifier
     + (arguments_list | field_suffix)[1, ...]
 ) # fmt: skip
@@ -396,6 +561,18 @@ def nest_calls(s, loc, toks):
 
 
 call.add_parse_action(nest_calls)
+call = Memoized(call)
+
+assignment_target = (
+    parenthesized(
+        DelimitedList(call | identifier, delimiter=","),
+        brackets=(("[", "]"),),
+        optional=True,
+    )
+    + ows
+    + Leaf("=")
+    + ows
+)
 
 """
 Anonymous function definition
@@ -406,12 +583,11 @@ Examples:
 anonymous_function = Leaf("@") + ows + (arguments_list | nothing(1)) + ows + expression
 
 # number = common.number.set_parse_action(model.Literal.from_tokens)
-number = Regex(r"[-+\d][\d.eE]*").set_parse_action(model.Literal.from_tokens)
+number = RegexLeaf(r"[-+\d][\d.eE]*")
 
-operand_atom = Forward()
 operation = Forward()
 operand = Forward()
-operand_atom << (
+operand_atom = (
     call
     | number
     | string
@@ -424,17 +600,27 @@ operand_atom << (
 )
 
 prefix_operation = (Leaf("-") | Leaf("~")) + operand_atom
-postfix_operation = operand_atom + (Leaf("'") | Leaf(".'"))
+postfix_operator = Leaf("'") | Leaf(".'")
 
-unary_operation = prefix_operation | postfix_operation
 
-operand << (
-    unary_operation | operand_atom | parenthesized(operand) | parenthesized(operation)
+def postfix_operation_or_operand_atom(toks):
+    if len(toks) == 1:
+        return toks[0]
+    return model.PostfixOperation.from_tokens(toks)
+
+
+# The operand atom is parsed once and then optionally wrapped into a postfix operation,
+# instead of being parsed again after trying a postfix operation.
+operand << Memoized(
+    prefix_operation
+    | (operand_atom + Opt(postfix_operator)).add_parse_action(
+        postfix_operation_or_operand_atom
+    )
 )
 operation << DelimitedList(operand, delimiter=operator, min_elements=2)
-expression << (operation | operand)
+expression << Memoized(operation | operand)
 
-keyword_statement = Or(Leaf(kw) for kw in ["return", "break", "continue"])
+keyword_statement = RegexLeaf(literal_or(["return", "break", "continue"]))
 
 
 statement_core = expression | keyword_statement
@@ -586,8 +772,20 @@ file = (
 """Content of a MATLAB code file consisting of code wrapped by optional white space."""
 
 
-# Packrat gives a massive performance increase.
-file.enable_packrat()
+def enable_packrat(cache_size: str):
+    """
+    Enable packrat parsing with the given cache size: "unbounded", "off" or a number of
+    cache entries, where 0 is the same as "off".
+    """
+    if cache_size in ("off", "0"):
+        ParserElement.disable_memoization()
+    elif cache_size == "unbounded":
+        ParserElement.enable_packrat(None, force=True)
+    elif cache_size.isdecimal():
+        ParserElement.enable_packrat(int(cache_size), force=True)
+    else:
+        raise ValueError(f"Invalid packrat cache size: {cache_size!r}")
+
 
 # Add parse actions to grammar objects that turn the tokens into the respective dataclass.
 parse_actions = {
@@ -605,20 +803,16 @@ parse_actions = {
     command_identifier: model.Literal,
     comment: model.Comment,
     expression_statement: model.Statement,
-    statement_delimiter: model.Literal,
-    element_delimiter: model.Literal,
     else_: model.Else,
     else_if: model.ElseIf,
     file: model.File,
     for_: model.ForLoop,
     function: model.Function,
-    identifier: model.Literal,
     if_: model.If,
     methods: model.Methods,
     operation: model.Operation,
     assignment_target: model.AssignmentTarget,
     assignment_statement: model.Statement,
-    postfix_operation: model.PostfixOperation,
     prefix_operation: model.PrefixOperation,
     properties: model.Properties,
     string: model.Literal,
@@ -627,16 +821,30 @@ parse_actions = {
     try_: model.Try,
     otherwise: model.Case,
     while_: model.WhileLoop,
-    ws: model.Literal,
 }
 
 for parser_element, target_class in parse_actions.items():
     parser_element.add_parse_action(target_class.from_tokens)
 
+# Streamline the complete grammar once, instead of on the first parse.
+file.streamline()
+
+# The elements that are re-entered during backtracking are memoized, which keeps nested
+# calls and brackets fast. Packrat parsing additionally caches every other element and
+# is slower on typical files, so it is off by default. Enabled once the grammar,
+# including its parse actions, is complete.
+enable_packrat(os.environ.get("KAKAPO_PACKRAT_CACHE", "off"))
+
 
 def parse_string(s: str) -> model.File:
     """Parse a MATLAB code string and return its representation model."""
-    parse_result = file.parse_string(s, parse_all=True)
+    try:
+        parse_result = file.parse_string(s, parse_all=True)
+    finally:
+        # The memoized elements already clear their caches once the outermost one
+        # returns. Clearing here as well guarantees that no cached model outlives this
+        # call.
+        reset_memoized_elements()
 
     file_: model.File = parse_result[0]
     for element in itertools.chain([file_], file_.descendants()):
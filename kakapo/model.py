@@ -1,44 +1,24 @@
 from __future__ import annotations
-from dataclasses import KW_ONLY, dataclass, field, fields
+from dataclasses import KW_ONLY, dataclass, field
+from functools import cache
 import re
 from typing import Generator, Sequence, Any, Type
 
 
-@dataclass
+@dataclass(slots=True)
 class Component:
     """Base class for all code elements."""
 
     _: KW_ONLY
-    _parent: Composite | None = field(default=None, repr=False)
-    _successor: Component | None = field(default=None, repr=False)
-    _predecessor: Component | None = field(default=None, repr=False)
-
-    @property
-    def parent(self) -> Composite | None:
-        return self._parent
-
-    @parent.setter
-    def parent(self, parent: Composite | None):
-        self._parent = parent
-
-    @property
-    def successor(self) -> Component | None:
-        return self._successor
-
-    @successor.setter
-    def successor(self, successor: Component | None):
-        self._successor = successor
-
-    @property
-    def predecessor(self) -> Component | None:
-        return self._predecessor
-
-    @predecessor.setter
-    def predecessor(self, predecessor: Component | None):
-        self._predecessor = predecessor
+    # Plain attributes instead of properties, as they are accessed for almost every
+    # element in the formatter. Not compared, as comparing them would compare the whole
+    # tree (and recurse endlessly between parent and child).
+    parent: Composite | None = field(default=None, repr=False, compare=False)
+    successor: Component | None = field(default=None, repr=False, compare=False)
+    predecessor: Component | None = field(default=None, repr=False, compare=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class Literal(Component):
     """Leaf with literal value."""
 
@@ -57,7 +37,9 @@ class Literal(Component):
     def __eq__(self, other: Literal | str) -> bool:
         if isinstance(other, str):
             return self.value == other
-        return self.value == other.value
+        if isinstance(other, Literal):
+            return self.value == other.value
+        return NotImplemented
 
     @classmethod
     def from_tokens(cls, tokens: Sequence):
@@ -66,7 +48,7 @@ class Literal(Component):
         return cls(tokens[0])
 
 
-@dataclass
+@dataclass(slots=True)
 class Missing(Component):
     """Leaf representing a missing optional element."""
 
@@ -74,29 +56,56 @@ class Missing(Component):
         return ""
 
 
-@dataclass
+@dataclass(slots=True)
 class Composite(Component):
 
-    _NON_CHILD_FIELDS = {"_parent", "_successor", "_predecessor"}
+    _NON_CHILD_FIELDS = {"parent", "successor", "predecessor"}
 
     def __iter__(self):
-        for name in self.__dataclass_fields__:
-            if name not in self._NON_CHILD_FIELDS:
-                yield getattr(self, name)
+        for name in self._child_names():
+            yield getattr(self, name)
+
+    @classmethod
+    @cache
+    def _child_names(cls) -> tuple[str, ...]:
+        """Names of the fields holding the children, in order."""
+        return tuple(
+            name
+            for name in cls.__dataclass_fields__
+            if name not in cls._NON_CHILD_FIELDS
+        )
 
     def descendants(self) -> Generator[Component]:
-        for child in self:
-            yield child
-            if isinstance(child, Composite):
-                for grand_child in child.descendants():
-                    yield grand_child
+        # Depth-first with a stack of child iterators, so that each descendant is
+        # yielded directly instead of through one generator per tree level.
+        stack = [iter(self)]
+        while stack:
+            for child in stack[-1]:
+                yield child
+                if isinstance(child, Composite):
+                    stack.append(iter(child))
+                    break
+            else:
+                stack.pop()
+
+    def descendants_by_type(self) -> dict[type[Component], list[Component]]:
+        """Descendants grouped by their exact type, each group in traversal order."""
+        groups: dict[type[Component], list[Component]] = {}
+        for descendant in self.descendants():
+            type_ = type(descendant)
+            group = groups.get(type_)
+            if group is None:
+                groups[type_] = [descendant]
+            else:
+                group.append(descendant)
+        return groups
 
     def __str__(self) -> str:
         strings = [str(child) for child in self]
         return "".join(strings)
 
     def __len__(self) -> int:
-        return len(fields(self))
+        return len(self._child_names())
 
     def __repr__(self) -> str:
         name = self.__class__.__name__
@@ -104,26 +113,31 @@ class Composite(Component):
 
     def __eq__(self, other) -> bool:
         """Elements are equal if they have equal type and their children are equal."""
-        if type(self) is not type(other) or len(self) != len(other):
+        if type(self) is not type(other):
             return False
-        return all(
-            own_child == other_child for own_child, other_child in zip(self, other)
-        )
+        # Tuple comparison checks the lengths and each child's identity before equality.
+        return tuple(self) == tuple(other)
 
     def descendants_and_indent(
         self, level: int = 0
     ) -> Generator[tuple[Component, int]]:
+        stack = [self._children_and_indent(level)]
+        while stack:
+            for child, child_level in stack[-1]:
+                yield child, child_level
+                if isinstance(child, Composite):
+                    stack.append(child._children_and_indent(child_level))
+                    break
+            else:
+                stack.pop()
+
+    def _children_and_indent(self, level: int) -> Generator[tuple[Component, int]]:
         for child in self:
+            # Clauses continuing a block are dedented to the level of the block.
             if isinstance(child, (Else, ElseIf, Catch)):
-                level -= 1
-            yield child, level
-            if isinstance(child, Composite):
-                for grand_child, grand_child_level in child.descendants_and_indent(
-                    level
-                ):
-                    yield grand_child, grand_child_level
-            if isinstance(child, (Else, ElseIf, Catch)):
-                level += 1
+                yield child, level - 1
+            else:
+                yield child, level
 
     def pretty_string(
         self,
@@ -170,8 +184,11 @@ class Composite(Component):
 class Construct:
     """A code element which can stand on its own: Statements, Blocks and Comments."""
 
+    __slots__ = ()
+
 
 class ElementsList(Composite):
+    __slots__ = ()
 
     @property
     def elements_list(self) -> DelimitedList:
@@ -182,13 +199,13 @@ class ElementsList(Composite):
         raise NotImplementedError
 
 
-@dataclass
+@dataclass(slots=True)
 class ArgumentsList(Composite):
     dot: Literal
     parenthesized: Parenthesized
 
 
-@dataclass
+@dataclass(slots=True)
 class AssignmentTarget(Composite):
     elements_list: DelimitedList
     whitespace_before_equal_sign: Literal
@@ -196,7 +213,7 @@ class AssignmentTarget(Composite):
     whitespace_after_equal_sign: Literal
 
 
-@dataclass
+@dataclass(slots=True)
 class Call(Composite):
     identifer: Literal
     arguments_list: ArgumentsList | Missing
@@ -208,18 +225,18 @@ class Call(Composite):
         return self.arguments_list.elements
 
 
-@dataclass
+@dataclass(slots=True)
 class Comment(Composite, Construct):
     marker: Literal
     content: Literal
 
 
-@dataclass
+@dataclass(slots=True)
 class Operation(Composite):
     delimited_list: DelimitedList
 
 
-@dataclass
+@dataclass(slots=True)
 class Parenthesized(Composite):
     opening_delimiter: Literal
     whitespace_before_content: Literal
@@ -228,13 +245,13 @@ class Parenthesized(Composite):
     closing_delimiter: Literal
 
 
-@dataclass
+@dataclass(slots=True)
 class Statement(Composite, Construct):
     output_arguments: AssignmentTarget | Missing
     body: Component
 
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class VariableLengthComposite(Composite):
     children: list[Component]
 
@@ -252,21 +269,27 @@ class VariableLengthComposite(Composite):
 
     @classmethod
     def from_tokens(cls, tokens: Sequence):
-        return cls(list(tokens))
+        # Slicing copies pyparsing results and lists into a new list in one step, which
+        # is faster than iterating them. Other sequences slice to their own type.
+        children = tokens[:]
+        if not isinstance(children, list):
+            children = list(children)
+        return cls(children)
 
 
 class Code(VariableLengthComposite):
-    pass
+    __slots__ = ()
 
 
 class DelimitedList(VariableLengthComposite):
+    __slots__ = ()
 
     @property
     def elements(self) -> list:
         return self.children[::2]
 
 
-@dataclass
+@dataclass(slots=True)
 class Block(Composite, Construct):
     name: Literal
     pre_head_delimiter: Literal
@@ -276,82 +299,72 @@ class Block(Composite, Construct):
     pre_end_delimiter: Literal
     end: End | Missing
 
-    def descendants_and_indent(
-        self, level: int = 0
-    ) -> Generator[tuple[Component, int]]:
+    def _children_and_indent(self, level: int) -> Generator[tuple[Component, int]]:
         for i, child in enumerate(self):
-            if i == 4:
-                level += 1
-            if i == 5:
-                level -= 1
-            yield child, level
-            if isinstance(child, Composite):
-                for grand_child, grand_child_level in child.descendants_and_indent(
-                    level
-                ):
-                    yield grand_child, grand_child_level
+            # The body is indented.
+            yield child, level + 1 if i == 4 else level
 
 
 class Function(Block):
-    pass
+    __slots__ = ()
 
 
 class Class(Block):
-    pass
+    __slots__ = ()
 
 
 class Properties(Block):
-    pass
+    __slots__ = ()
 
 
 class Methods(Block):
-    pass
+    __slots__ = ()
 
 
 class If(Block):
-    pass
+    __slots__ = ()
 
 
 class ForLoop(Block):
-    pass
+    __slots__ = ()
 
 
 class WhileLoop(Block):
-    pass
+    __slots__ = ()
 
 
 class Try(Block):
-    pass
+    __slots__ = ()
 
 
 class Catch(Block):
-    pass
+    __slots__ = ()
 
 
 class SwitchBody(VariableLengthComposite):
-    pass
+    __slots__ = ()
 
 
 class Switch(Block):
-    pass
+    __slots__ = ()
 
 
 class Case(Block):
-    pass
+    __slots__ = ()
 
 
 class Otherwise(Block):
-    pass
+    __slots__ = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class File(Composite):
     leading_delimiter: Literal
     code: Code
     trailing_delimiter: Literal
 
 
-@dataclass
+@dataclass(slots=True)
 class AnonymousFunction(Composite):
     at_sign: Literal
     white_space_before_arguments: Literal
@@ -364,41 +377,41 @@ class AnonymousFunction(Composite):
         return self.arguments_list.elements
 
 
-@dataclass
+@dataclass(slots=True)
 class Array(Composite):
     parenthesized: Parenthesized
 
 
-@dataclass
+@dataclass(slots=True)
 class PrefixOperation(Composite):
     operator: Literal
     operand: Component
 
 
-@dataclass
+@dataclass(slots=True)
 class PostfixOperation(Composite):
     operand: Component
     operator: Literal
 
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class Command(VariableLengthComposite, Construct):
     pass
 
 
 class Classdef(Block):
-    pass
+    __slots__ = ()
 
 
 class Else(Block):
-    pass
+    __slots__ = ()
 
 
 class ElseIf(Block):
-    pass
+    __slots__ = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class ArgumentDefinition(Composite):
     name: Literal
     pre_shape_delimiter: Literal
@@ -408,20 +421,21 @@ class ArgumentDefinition(Composite):
 
 
 class ArgumentDefinitionGroup(VariableLengthComposite):
-    pass
+    __slots__ = ()
 
 
 class Arguments(Block):
-    pass
+    __slots__ = ()
 
 
 class End(Component):
+    __slots__ = ()
 
     def __str__(self) -> str:
         return "end"
 
 
-@dataclass
+@dataclass(slots=True)
 class FieldAccess(Composite):
     container: Literal
     field: Literal
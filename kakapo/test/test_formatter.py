@@ -1,3 +1,5 @@
+import os
+
 import pytest
 from typing import Any, Callable
 
@@ -228,5 +230,51 @@ def test_add_empty_lines_before_and_after_block(string: str, expected: str):
     assert actual == expected
 
 
+@pytest.mark.parametrize(
+    "string, expected",
+    (
+        ("a  =   [ 1 ,2 ] ;", "a = [1, 2];"),
+        ("return ;\n\n\n%comment", "return\n\n%comment"),
+    ),
+)
+def test_apply_formatters(string: str, expected: str):
+    element = grammar.parse_string(string)
+    formatter.apply_formatters(
+        element,
+        formatter.normalize_whitespace_in_delimited_list,
+        formatter.normalize_whitespace_in_parenthesized,
+        formatter.normalize_whitespace_in_assignment,
+        formatter.remove_white_space_before_semicolon,
+        formatter.remove_white_space_and_semicolon_after_keyword,
+        formatter.remove_excess_empty_lines,
+    )
+    assert str(element) == expected
+
+
+@pytest.mark.parametrize("string", ("", "   ", "\n\n", " ;\n ;", "\t;;"))
+def test_format_blank_string(string: str):
+    # The shortcut for blank files must give the same result as formatting the model.
+    file_model = grammar.parse_string(string)
+    formatter.format_model(file_model)
+    assert formatter.format_string(string) == str(file_model) == "\n"
+
+
+@pytest.mark.parametrize(
+    "string, expected, modified",
+    (
+        ("a  =  1", "a = 1\n", True),
+        ("a = 1\n", "a = 1\n", False),
+        ("a = 1\r\n", "a = 1\n", True),
+    ),
+)
+def test_format_file(tmp_path, string: str, expected: str, modified: bool):
+    file_path = tmp_path / "file.m"
+    file_path.write_bytes(string.encode())
+    os.utime(file_path, ns=(0, 0))
+    formatter.format_file(file_path)
+    assert file_path.read_bytes() == expected.encode()
+    assert (file_path.stat().st_mtime_ns != 0) == modified
+
+
 if __name__ == "__main__":
     pytest.main()
\ No newline at end of file
@@ -43,7 +43,9 @@ def test_optional_white_space_error(string):
     assert_parsing_fails(grammar.ows, string)
 
 
-@pytest.mark.parametrize("string", ("var", "x", "TEST", "x_123", "a" * 63))
+@pytest.mark.parametrize(
+    "string", ("var", "x", "TEST", "x_123", "a" * 63, "endless", "if_", "End")
+)
 def test_identifier(string):
     actual = grammar.identifier.parse_string(string)[0]
     expected = model.Literal(string)
@@ -90,17 +92,20 @@ def test_operator_error(string):
     assert_parsing_fails(grammar.operator, string)
 
 
+RESERVED_KEYWORD = grammar.ReservedKeyword()
+
+
 @pytest.mark.parametrize("string", grammar.KEYWORDS)
 def test_keyword(string):
-    assert_parsing_returns_unmodified_string(grammar.ReservedKeyword(), string)
+    assert_parsing_returns_unmodified_string(RESERVED_KEYWORD, string)
 
 
 @pytest.mark.parametrize("string", ["", "disp", "test", ".", "class", "iff"])
 def test_keyword_error(string):
-    assert_parsing_fails(grammar.ReservedKeyword(), string)
+    assert_parsing_fails(RESERVED_KEYWORD, string)
 
 
-@pytest.mark.parametrize("string", ["", "_a", "asd$"])
+@pytest.mark.parametrize("string", ["", "_a", "asd$", "end", "elseif", "while"])
 def test_identifier_error(string):
     assert_parsing_fails(grammar.identifier, string)
 
@@ -172,22 +177,26 @@ def test_command_error(string):
     assert_parsing_fails(grammar.command, string)
 
 
+COMMA_LIST = grammar.DelimitedList(grammar.identifier, delimiter=",")
+DOUBLE_SEMICOLON_LIST = grammar.DelimitedList(grammar.identifier, delimiter=";;")
+
+
 @pytest.mark.parametrize(
     ["string", "parser", "expected"],
     (
         (
             "a",
-            grammar.DelimitedList(grammar.identifier, delimiter=","),
+            COMMA_LIST,
             model.DelimitedList([model.Literal(s) for s in ["a", ""]]),
         ),
         (
             "a\n, b",
-            grammar.DelimitedList(grammar.identifier, delimiter=","),
+            COMMA_LIST,
             model.DelimitedList([model.Literal(s) for s in ["a", "\n, ", "b", ""]]),
         ),
         (
             "a ;; b   ;;c ;;",
-            grammar.DelimitedList(grammar.identifier, delimiter=";;"),
+            DOUBLE_SEMICOLON_LIST,
             model.DelimitedList(
                 [model.Literal(s) for s in ["a", " ;; ", "b", "   ;;", "c", " ;;"]]
             ),
@@ -465,7 +474,24 @@ def test_prefix_operation(string):
     ),
 )
 def test_postfix_operation(string):
-    assert_parsing_returns_unmodified_string(grammar.postfix_operation, string)
+    assert_parsing_returns_unmodified_string(grammar.operand, string)
+    assert isinstance(parse(string, grammar.operand), model.PostfixOperation)
+
+
+@pytest.mark.parametrize(
+    "string, type_",
+    (
+        ("a", model.Literal),
+        ("a'", model.PostfixOperation),
+        ("-a", model.PrefixOperation),
+        ("((a))", model.Parenthesized),
+        ("(a + b).'", model.PostfixOperation),
+    ),
+)
+def test_operand(string, type_):
+    actual = parse(string, grammar.operand)
+    assert type(actual) is type_
+    assert str(actual) == string
 
 
 @pytest.mark.parametrize(
@@ -536,5 +562,70 @@ def test_arguments_list(string):
     assert_parsing_returns_unmodified_string(grammar.arguments_list, string)
 
 
+@pytest.mark.parametrize("opening_bracket", ["", "(("])
+def test_bracketed_error(opening_bracket):
+    with pytest.raises(ValueError):
+        grammar.Bracketed({opening_bracket: grammar.Leaf("(")})
+
+
+@pytest.mark.parametrize("cache_size", ["", "-1", "none", "1.5", "²"])
+def test_enable_packrat_error(cache_size):
+    with pytest.raises(ValueError):
+        grammar.enable_packrat(cache_size)
+
+
+@pytest.mark.parametrize("cache_size", ["0", "off"])
+def test_enable_packrat_off(cache_size):
+    grammar.enable_packrat("100")
+    grammar.enable_packrat(cache_size)
+    assert not pp.ParserElement._packratEnabled
+
+
+def test_parse_string_returns_new_model():
+    string = "x = f(g(a + 1), b');\n"
+    first = grammar.parse_string(string)
+    second = grammar.parse_string(string)
+    assert str(second) == string
+    first_ids = {id(e) for e in first.descendants()}
+    second_ids = {id(e) for e in second.descendants()}
+    assert not first_ids & second_ids
+
+
+def test_element_parse_string_returns_new_model():
+    string = "f(a, b)"
+    first = grammar.expression.parse_string(string)[0]
+    first.arguments_list.parenthesized.content[1] = model.Literal("XX")
+    second = grammar.expression.parse_string(string)[0]
+    assert second is not first
+    assert str(second) == string
+
+
+@pytest.mark.parametrize(
+    "string, other, equal",
+    (
+        ("x = f(a, b);\n", "x = f(a, b);\n", True),
+        ("x = f(a, b);\n", "x = f(a, c);\n", False),
+        ("if a\n  b\nend", "if a\n  b\nend", True),
+    ),
+)
+def test_model_equality(string, other, equal):
+    assert (grammar.parse_string(string) == grammar.parse_string(other)) == equal
+
+
+@pytest.mark.parametrize(
+    "tokens",
+    (
+        [model.Literal("a")],
+        (model.Literal("a"),),
+        grammar.identifier.parse_string("a"),
+    ),
+)
+def test_from_tokens_copies_into_list(tokens):
+    delimited_list = model.DelimitedList.from_tokens(tokens)
+    assert type(delimited_list.children) is list
+    assert delimited_list.children is not tokens
+    assert delimited_list.children == [model.Literal("a")]
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -4,8 +4,11 @@ import time
 class Timer:
 
     def __enter__(self):
-        self.start = time.time()
+        self.elapsed = None
+        self.start = time.perf_counter_ns()
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        elapsed = time.time() - self.start
-        print(f"Elapsed: {elapsed:.1f} s")
\ No newline at end of file
+        # Elapsed time in seconds.
+        self.elapsed = (time.perf_counter_ns() - self.start) / 1e9
+        print(f"Elapsed: {self.elapsed:.6f} s")
@@ -1,13 +1,15 @@
 import argparse
+import multiprocessing
 from pathlib import Path
 
-import pyparsing
-
-from kakapo import formatter
-
 
 def format_file(file_path: Path):
-    print(f'{file_path}')
+    # Imported here, since importing the formatter builds the grammar. "--help" or a
+    # wrong path does not need it.
+    import pyparsing
+    from kakapo import formatter
+
+    print(f"{file_path}")
     try:
         formatter.format_file(file_path)
     except pyparsing.ParseException as e:
@@ -16,9 +18,28 @@ def format_file(file_path: Path):
     return True
 
 
+def positive_int(string: str) -> int:
+    value = int(string)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+
 def main():
-    parser = argparse.ArgumentParser(prog="Kakapo", description="A flightless MATLAB formatter")
-    parser.add_argument('path', type=str, help='Path of MATLAB .m file or directory')
+    parser = argparse.ArgumentParser(
+        prog="Kakapo", description="A flightless MATLAB formatter"
+    )
+    parser.add_argument("path", type=str, help="Path of MATLAB .m file or directory")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=None,
+        help=(
+            "Number of processes formatting the files of a directory "
+            "(default: number of CPUs)"
+        ),
+    )
 
     args = parser.parse_args()
     path = Path(args.path)
@@ -28,8 +49,18 @@ def main():
     if path.is_file():
         success = format_file(path)
     elif path.is_dir():
-        for file_path in path.glob("**/*.m"):
-            success = format_file(file_path)
+        file_paths = list(path.glob("**/*.m"))
+        if args.jobs == 1:
+            results = [format_file(file_path) for file_path in file_paths]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Files are formatted independently, so they can be spread over processes.
+            # Each file is handed out on its own, since formatting it outweighs sending
+            # it to a worker.
+            with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+                results = list(executor.map(format_file, file_paths))
+        success = all(results)
     else:
         print("Path not found.")
         success = False
@@ -38,4 +69,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Required for the process pool in executables built with PyInstaller.
+    multiprocessing.freeze_support()
     main()